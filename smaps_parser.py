@@ -6,8 +6,11 @@
 
 import argparse
 import re
-from collections import Counter
+from itertools import chain
+import mmap
+from operator import itemgetter
 import os
+import stat
 import subprocess
 
 type_length = 40
@@ -85,9 +88,7 @@ pss_type = ["Unknown (未知内存)", "Dalvik (Dalvik虚拟机运行时内存)",
                     "dalvik other lineralloc (Dalvik线性分配器内存)","dalvik other accounting (Dalvik内存记账)","dalvik other zygote code cache (Zygote代码缓存)","dalvik other app code cache (应用代码缓存)","dalvik other compiler metadata (编译器元数据)","dalvik other indirect reference table (间接引用表)" ,\
                         "dex boot vdex (启动阶段DEX验证文件)","dex app dex (应用DEX文件)","dex app vdex (应用DEX验证文件)", \
                             "heap art app (应用ART堆)","heap art boot (启动ART堆)", "native heap (本地堆)", "dmabuf (直接内存缓冲区)", "jit cache (即时编译缓存)", "zygote code cache (Zygote代码缓存)", "app code cache (应用代码缓存)"]
-type_list = []
-for i in range(type_length):
-    type_list.append({})
+type_list = [{} for _ in range(type_length)]
 
 #制作提示
 def help():
@@ -100,8 +101,16 @@ def help():
     parse.add_argument('-s', '--simple', action="store_true", help="simple output", default=False)
     return parse.parse_args()
 
-def match_head(line):
-    return re.match(r'(\w*)-(\w*) (\S*) (\w*) (\w*):(\w*) (\w*)\s*(.+)$', line, re.I)
+# Mapping headers and the Pss/SwapPss fields fused into one pattern, so the
+# whole file is scanned by a single finditer and dispatched on lastgroup.
+# Each alternative starts with the '\n' ending the previous line, which lets
+# re jump straight to line starts; parse_smaps feeds line one separately.
+# Only the mapping name is captured from a header; address/perms/offset/
+# dev/inode are matched but never consulted.
+SMAPS_PATTERN = re.compile(
+    rb'\n(?:\w*-\w* \S* \w* \w*:\w* \w*[^\S\n]*(?P<name>[^\r\n]+)'
+    rb'|Pss:[^\S\n]+(?P<pss>[0-9.]+)[^\S\n]*[kM]B'
+    rb'|SwapPss:[^\S\n]+(?P<swapPss>[0-9.]+)[^\S\n]*[kM]B)', re.I)
 
 def match_type(name, prewhat):
     which_heap = HEAP_UNKNOWN
@@ -225,60 +234,75 @@ def match_type(name, prewhat):
         which_heap = 10
     return which_heap
 
-def match_pss(line):
-    tmp = re.match(r'Pss:\s+([0-9.]+)\s*[kM]B\s*(?::?\s*(.+))?', line, re.I)
-    if tmp:
-        return tmp
+# smaps field group -> counter it accumulates into
+smaps_fields = {
+    "pss": pss_count,
+    "swapPss": swapPss_count,
+}
 
-def match_swapPss(line):
-    tmp = re.match(r'SwapPss:\s+([0-9.]+)\s*[kM]B\s*(?::?\s*(.+))?', line, re.I)
-    if tmp:
-        return tmp
+def reset_state():
+    # Clear the totals in place: smaps_fields and importers of this module
+    # hold references to these lists, so they must never be rebound.
+    pssSum_count[:] = [0] * type_length
+    pss_count[:] = [0] * type_length
+    swapPss_count[:] = [0] * type_length
+    type_list[:] = [{} for _ in range(type_length)]
 
 def parse_smaps(filename):
-    file = open(filename, 'r')
-    line = file.readline()
-    if not line:
-        return
+    with open(filename, 'rb') as file:
+        st = os.fstat(file.fileno())
+        if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+            # Scan the page cache in place: no read() copy, no decode of the
+            # three quarters of the file that is neither a header nor Pss/SwapPss.
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                _parse_smaps_buffer(mm)
+        else:
+            # /proc files and pipes report size 0 and cannot be mapped.
+            _parse_smaps_buffer(file.read())
+
+def _parse_smaps_buffer(mm):
     what = 0
     prewhat = 0
     name = ""  # Initialize name here
-    while 1:
-        tmp = match_head(line)
-        if tmp:
-            name = tmp.group(8)
-            # print("name:" + name)
-            what = match_type(name, prewhat)
-            # print "name = " + name + "what = " + str(what)
-        while 1:
-            line2 = file.readline()
-            if not line2:
-                return
-            tmp2 = match_pss(line2)
-            tmp3 = match_swapPss(line2)
-            pss = 0  # Initialize pss with default value
-            if tmp2 or tmp3:
-                if what >= 0:
-                    if tmp2:
-                        pss = int(tmp2.group(1))
-                        pss_count[what] += pss
-                    if tmp3:
-                        pss = int(tmp3.group(1))
-                        swapPss_count[what] += pss
-                    # print("what:%d, pss:%d" % (what, pss))
-                    if pss > 0:
-                        pssSum_count[what] += pss
-                        tmplist = type_list[what]
-                        if name in tmplist:
-                            tmplist[name] += pss
-                        else:
-                            tmplist[name] = pss
+    # A library is usually mapped several times (r--p, r-xp, rw-p, ...), so
+    # decode and classify each distinct name once; the blank " " name depends
+    # on prewhat, so it is never cached.
+    heap_by_name = {}
+    first_end = mm.find(b"\n")
+    if first_end < 0:
+        first_end = len(mm)
+    matches = chain(SMAPS_PATTERN.finditer(b"\n" + mm[:first_end]),
+                    SMAPS_PATTERN.finditer(mm, first_end))
+    # Module-level tables bound to locals once for the per-match loop.
+    fields = smaps_fields
+    sum_count = pssSum_count
+    types = type_list
+    for tmp in matches:
+        field = tmp.lastgroup
+        if field == "name":
+            prewhat = what
+            raw_name = tmp.group("name")
+            cached = heap_by_name.get(raw_name)
+            if cached:
+                name, what = cached
             else:
-                tmp3 = match_head(line2)
-                if tmp3:
-                    line = line2
-                    prewhat = what
-                    break
+                name = raw_name.decode("utf-8", "replace")
+                # print("name:" + name)
+                what = match_type(name, prewhat)
+                if name != " ":
+                    heap_by_name[raw_name] = (name, what)
+            # print "name = " + name + "what = " + str(what)
+        elif what >= 0:
+            pss = int(tmp.group(field))
+            fields[field][what] += pss
+            # print("what:%d, pss:%d" % (what, pss))
+            if pss > 0:
+                sum_count[what] += pss
+                tmplist = types[what]
+                if name in tmplist:
+                    tmplist[name] += pss
+                else:
+                    tmplist[name] = pss
 
 def print_result(args):
     if args.pid and not args.output:
@@ -287,82 +311,62 @@ def print_result(args):
         output = args.output
     type = args.type
     simple = args.simple
-    index = -1
-    if not type == "ALL":
-        if type in pss_type:
-            index = pss_type.index(type)
-        else:
-            print("Please enter a correct memory type")
-            return
-    output_file = open(output, 'w')
-    if index == -1:
-        for i,j,m,n,z in zip(pss_type, pssSum_count, pss_count, swapPss_count, type_list):
-            tmp = "%s : %.3f M" % (i, float(j)/1000)
-            print(tmp)
-            output_file.write(tmp)
-            output_file.write("\n")
-            tmp = "\tpss: %.3f M" % (float(m) / 1000)
-            print(tmp)
-            output_file.write(tmp)
-            output_file.write("\n")
-            tmp = "\tswapPss: %.3f M" % (float(n) / 1000)
-            print(tmp)
-            output_file.write(tmp)
-            output_file.write("\n")
-            if not simple:
-                count = Counter(z)
-                for j in count.most_common():
-                    tmp = "\t\t%s : %d kB" % (j[0], j[1])
-                    print(tmp)
-                    output_file.write(tmp)
-                    output_file.write("\n")
+    if type == "ALL":
+        indexes = range(type_length)
+    elif type in pss_type:
+        indexes = [pss_type.index(type)]
     else:
-        tmp = "%s : %.3f M" % (pss_type[index], float(pssSum_count[index]) / 1000)
-        print(tmp)
-        output_file.write(tmp)
-        output_file.write("\n")
-        tmp = "\tpss: %.3f M" % (float(pss_count[index]) / 1000)
-        print(tmp)
-        output_file.write(tmp)
-        output_file.write("\n")
-        tmp = "\tswapPss: %.3f M" % (float(swapPss_count[index]) / 1000)
-        print(tmp)
-        output_file.write(tmp)
-        output_file.write("\n")
+        print("Please enter a correct memory type")
+        return
+    # Collect the report and emit it once to stdout and once to the file,
+    # instead of a print() plus two write() calls per line.
+    lines = []
+    for index in indexes:
+        lines.append("%s : %.3f M" % (pss_type[index], float(pssSum_count[index]) / 1000))
+        lines.append("\tpss: %.3f M" % (float(pss_count[index]) / 1000))
+        lines.append("\tswapPss: %.3f M" % (float(swapPss_count[index]) / 1000))
         if not simple:
-            count = Counter(type_list[index])
-            for j in count.most_common():
-                tmp = "\t\t%s : %d kB" % (j[0], j[1])
-                print(tmp)
-                output_file.write(tmp)
-                output_file.write("\n")
+            mappings = sorted(type_list[index].items(), key=itemgetter(1), reverse=True)
+            lines.extend(["\t\t%s : %d kB" % item for item in mappings])
+    report = "\n".join(lines) + "\n"
+    print(report, end="")
+    with open(output, 'w') as output_file:
+        output_file.write(report)
 
 if __name__ == "__main__":
     args = help()
     if args.filename:
-        if os.path.exists(args.filename):
+        try:
             parse_smaps(args.filename)
-            print_result(args)
-        else:
+        except FileNotFoundError:
             print("smaps is not exist")
+        else:
+            print_result(args)
     elif args.pid:
         if args.pid.isdigit():
             pid = int(args.pid)
             if pid > 0:
-                check_cmd = "adb shell su root ls /proc/%d/smaps >> /dev/null" % int(pid)
-                ret = os.system(check_cmd)
-                if ret == 0:
-                    cmd = "adb shell su root cat /proc/%d/smaps" % int(pid)
-                    smaps_filename = "%d_smaps_file.txt" % pid
-                    ret = os.popen(cmd)
-                    new_file = open(smaps_filename, 'w')
-                    lines = ret.readlines()
-                    for line in lines:
-                        new_file.write(line)
+                # One adb round-trip: cat's exit status doubles as the access check.
+                # adb writes straight into the file, nothing is buffered in Python.
+                cmd = ["adb", "shell", "su", "root", "cat", "/proc/%d/smaps" % pid]
+                smaps_filename = "%d_smaps_file.txt" % pid
+                error = "/proc/%d/smaps cannot be accessed" % pid
+                with open(smaps_filename, 'wb') as new_file:
+                    try:
+                        # subprocess kills adb if a wedged device/server stalls it.
+                        ret = subprocess.call(cmd, stdout=new_file, timeout=60)
+                    except subprocess.TimeoutExpired:
+                        error = "adb timed out reading /proc/%d/smaps" % pid
+                        ret = -1
+                    except OSError:
+                        # adb is not installed or not on PATH.
+                        ret = -1
+                if ret == 0 and os.path.getsize(smaps_filename) > 0:
                     parse_smaps(smaps_filename)
                     print_result(args)
                 else:
-                    print("/proc/%d/smaps cannot be accessed" % pid)
+                    os.remove(smaps_filename)
+                    print(error)
             else:
                 print("Please enter a correct pid")
         else: